@@ -2,6 +2,25 @@ provider "aws" {
   region = "ap-south-1"
 }
 
+# optional dax cluster in front of single-order reads and writes
+variable "dax_endpoint" {
+  type        = string
+  default     = ""
+  description = "DAX cluster endpoint (dax://...); leave empty to talk to DynamoDB directly"
+}
+
+variable "dax_subnet_ids" {
+  type        = list(string)
+  default     = []
+  description = "Subnets shared with the DAX cluster, used when dax_endpoint is set"
+}
+
+variable "dax_security_group_ids" {
+  type        = list(string)
+  default     = []
+  description = "Security groups allowed to reach the DAX cluster, used when dax_endpoint is set"
+}
+
 resource "aws_dynamodb_table" "orders_table" {
   name           = "Orders"
   billing_mode   = "PAY_PER_REQUEST"
@@ -11,19 +30,69 @@ resource "aws_dynamodb_table" "orders_table" {
     name = "order_id"
     type = "S"
   }
+
+  attribute {
+    name = "status"
+    type = "S"
+  }
+
+  attribute {
+    name = "created_at"
+    type = "S"
+  }
+
+  # lets list_orders and the expiry lambda query by status instead of scanning
+  global_secondary_index {
+    name            = "StatusIndex"
+    hash_key        = "status"
+    range_key       = "created_at"
+    projection_type = "ALL"
+  }
 }
 
 data "archive_file" "lambda_zip" {
   type        = "zip"
-  source_file = "${path.module}/../src/app.py"
   output_path = "${path.module}/lambda_function.zip"
+
+  source {
+    content  = file("${path.module}/../src/app.py")
+    filename = "app.py"
+  }
+
+  source {
+    content  = file("${path.module}/../src/common.py")
+    filename = "common.py"
+  }
 }
 
 # zip file for order expiry lambda
 data "archive_file" "expiry_lambda_zip" {
   type        = "zip"
-  source_file = "${path.module}/../src/order_expiry.py"
   output_path = "${path.module}/order_expiry.zip"
+
+  source {
+    content  = file("${path.module}/../src/order_expiry.py")
+    filename = "order_expiry.py"
+  }
+
+  source {
+    content  = file("${path.module}/../src/common.py")
+    filename = "common.py"
+  }
+}
+
+# orjson lambda layer, built into infra/build/orjson_layer (see readme)
+data "archive_file" "orjson_layer_zip" {
+  type        = "zip"
+  source_dir  = "${path.module}/build/orjson_layer"
+  output_path = "${path.module}/orjson_layer.zip"
+}
+
+resource "aws_lambda_layer_version" "orjson" {
+  filename            = data.archive_file.orjson_layer_zip.output_path
+  layer_name          = "orjson"
+  compatible_runtimes = ["python3.9"]
+  source_code_hash    = data.archive_file.orjson_layer_zip.output_base64sha256
 }
 
 resource "aws_iam_role" "lambda_role" {
@@ -51,8 +120,14 @@ resource "aws_iam_role_policy" "lambda_policy" {
         "dynamodb:PutItem",
         "dynamodb:GetItem",
         "dynamodb:Scan",
+        "dynamodb:Query",
+        "dynamodb:BatchWriteItem",
         "dynamodb:UpdateItem",
         "dynamodb:DeleteItem",
+        "dax:PutItem",
+        "dax:GetItem",
+        "dax:UpdateItem",
+        "dax:DeleteItem",
         "logs:CreateLogGroup",
         "logs:CreateLogStream",
         "logs:PutLogEvents"
@@ -62,19 +137,45 @@ resource "aws_iam_role_policy" "lambda_policy" {
   })
 }
 
+# network interface permissions for running the api lambda inside the dax vpc
+resource "aws_iam_role_policy_attachment" "lambda_vpc_access" {
+  count      = var.dax_endpoint == "" ? 0 : 1
+  role       = aws_iam_role.lambda_role.name
+  policy_arn = "arn:aws:iam::aws:policy/service-role/AWSLambdaVPCAccessExecutionRole"
+}
+
 resource "aws_lambda_function" "order_receiver" {
   filename         = data.archive_file.lambda_zip.output_path
   function_name    = "OrderReceiver"
   role             = aws_iam_role.lambda_role.arn
   handler          = "app.lambda_handler"
   runtime          = "python3.9"
+  layers           = [aws_lambda_layer_version.orjson.arn]
   source_code_hash = data.archive_file.lambda_zip.output_base64sha256
+
+  environment {
+    variables = {
+      DAX_ENDPOINT = var.dax_endpoint
+    }
+  }
+
+  # dax is only reachable from inside its vpc
+  dynamic "vpc_config" {
+    for_each = var.dax_endpoint == "" ? [] : [1]
+    content {
+      subnet_ids         = var.dax_subnet_ids
+      security_group_ids = var.dax_security_group_ids
+    }
+  }
 }
 
 # api gateway rest api
 resource "aws_api_gateway_rest_api" "order_api" {
   name        = "OrderAPI"
   description = "API Gateway for Order System"
+
+  # lets the lambda return gzipped, base64 encoded bodies
+  binary_media_types = ["*/*"]
 }
 
 # /orders resource
@@ -197,6 +298,15 @@ resource "aws_api_gateway_deployment" "order_api_deployment" {
   ]
 
   rest_api_id = aws_api_gateway_rest_api.order_api.id
+
+  # binary media types only reach the stage on a new deployment
+  triggers = {
+    redeployment = sha1(jsonencode(aws_api_gateway_rest_api.order_api.binary_media_types))
+  }
+
+  lifecycle {
+    create_before_destroy = true
+  }
 }
 
 # api gateway stage
@@ -233,6 +343,7 @@ resource "aws_lambda_function" "order_expiry" {
   role             = aws_iam_role.lambda_role.arn
   handler          = "order_expiry.lambda_handler"
   runtime          = "python3.9"
+  layers           = [aws_lambda_layer_version.orjson.arn]
   timeout          = 60
   source_code_hash = data.archive_file.expiry_lambda_zip.output_base64sha256
 }
@@ -1,22 +1,55 @@
-import json
+import os
+import base64
+import gzip
 import boto3
+import orjson
 import uuid
-from decimal import Decimal
+from boto3.dynamodb.conditions import Key
+from botocore.exceptions import ClientError
 from datetime import datetime
+from common import STATUS_INDEX, config, decimal_default, to_json
 
-dynamodb = boto3.resource('dynamodb')
+dynamodb = boto3.resource('dynamodb', config=config)
 table = dynamodb.Table('Orders')
 
-# helper function to convert decimal to int/float for json serialization
-def decimal_to_number(obj):
-    if isinstance(obj, list):
-        return [decimal_to_number(i) for i in obj]
-    elif isinstance(obj, dict):
-        return {k: decimal_to_number(v) for k, v in obj.items()}
-    elif isinstance(obj, Decimal):
-        return int(obj) if obj % 1 == 0 else float(obj)
-    else:
-        return obj
+# low-level client behind the resource, for writes with pre-marshaled items
+client = dynamodb.meta.client
+
+# route single-item reads and this lambda's writes through dax when a cluster
+# is configured, so its write-through item cache sees creates and updates.
+# the expiry lambda writes to dynamodb directly, so get_order can report an
+# expired order as PENDING until the cluster's item ttl runs out
+DAX_ENDPOINT = os.environ.get('DAX_ENDPOINT')
+if DAX_ENDPOINT:
+    from amazondax import AmazonDaxClient
+    dax = AmazonDaxClient.resource(endpoint_url=DAX_ENDPOINT)
+    item_table = dax.Table('Orders')
+    item_client = dax.meta.client
+else:
+    item_client = client
+    item_table = table
+
+# orjson parses integers beyond 64 bits as rounded floats, so create_order
+# rejects quantities at or beyond this magnitude rather than store them rounded
+QUANTITY_LIMIT = 2 ** 63
+
+# statuses accepted by update_order
+ALLOWED_STATUSES = frozenset({'PENDING', 'PROCESSING', 'COMPLETED', 'CANCELLED', 'EXPIRED'})
+ALLOWED_STATUSES_ERROR = 'status must be one of: ' + ', '.join(sorted(ALLOWED_STATUSES))
+
+# page size for list_orders when no limit is given, and the largest allowed
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+# list_orders bodies larger than this are gzipped for clients that accept it
+GZIP_MIN_BYTES = 1024
+
+# parse the json request body, which api gateway base64 encodes for binary media types
+def parse_body(event):
+    body = event['body']
+    if event.get('isBase64Encoded'):
+        body = base64.b64decode(body)
+    return orjson.loads(body)
 
 def lambda_handler(event, context):
     try:
@@ -37,152 +70,265 @@ def lambda_handler(event, context):
         else:
             return {
                 'statusCode': 400,
-                'body': json.dumps({'error': 'unsupported method'})
+                'body': to_json({'error': 'unsupported method'})
             }
     
     except Exception as e:
         return {
             'statusCode': 500,
-            'body': json.dumps({'error': str(e)})
+            'body': to_json({'error': str(e)})
         }
 
 # create new order
 def create_order(event):
-    body = json.loads(event['body'])
+    body = parse_body(event)
     
     # validate required fields
     if 'item' not in body or 'quantity' not in body:
         return {
             'statusCode': 400,
-            'body': json.dumps({'error': 'item and quantity are required'})
+            'body': to_json({'error': 'item and quantity are required'})
+        }
+    
+    quantity = body['quantity']
+    if isinstance(quantity, bool) or not isinstance(quantity, (int, float)):
+        return {
+            'statusCode': 400,
+            'body': to_json({'error': 'quantity must be a number'})
+        }
+    
+    if not -QUANTITY_LIMIT < quantity < QUANTITY_LIMIT:
+        return {
+            'statusCode': 400,
+            'body': to_json({'error': 'quantity is out of range'})
         }
     
-    order_id = str(uuid.uuid4())
+    order_id = uuid.uuid4().hex
     created_at = datetime.utcnow().isoformat() + 'Z'
     
     item = {
         'order_id': order_id,
         'item': body['item'],
-        'quantity': body['quantity'],
+        'quantity': quantity,
         'status': 'PENDING',
         'customer_name': body.get('customer_name', 'anonymous'),
         'customer_email': body.get('customer_email', ''),
         'created_at': created_at
     }
     
-    table.put_item(Item=item)
+    # text fields are written as S attributes below
+    for field in ('item', 'customer_name', 'customer_email'):
+        if not isinstance(item[field], str):
+            return {
+                'statusCode': 400,
+                'body': to_json({'error': f'{field} must be a string'})
+            }
+    
+    # write through the client with the item already in attribute value form,
+    # skipping the resource layer's per-attribute type serialization
+    item_client.put_item(
+        TableName=table.name,
+        Item={
+            'order_id': {'S': order_id},
+            'item': {'S': item['item']},
+            'quantity': {'N': str(quantity)},
+            'status': {'S': 'PENDING'},
+            'customer_name': {'S': item['customer_name']},
+            'customer_email': {'S': item['customer_email']},
+            'created_at': {'S': created_at}
+        }
+    )
     
     return {
         'statusCode': 201,
         'headers': {'Content-Type': 'application/json'},
-        'body': json.dumps({
+        'body': to_json({
             'message': 'order created successfully',
-            'order': decimal_to_number(item)
+            'order': item
         })
     }
 
 # get single order by id
 def get_order(order_id):
-    response = table.get_item(Key={'order_id': order_id})
+    response = item_table.get_item(Key={'order_id': order_id})
     
     if 'Item' not in response:
         return {
             'statusCode': 404,
-            'body': json.dumps({'error': 'order not found'})
+            'body': to_json({'error': 'order not found'})
         }
     
     return {
         'statusCode': 200,
         'headers': {'Content-Type': 'application/json'},
-        'body': json.dumps({
-            'order': decimal_to_number(response['Item'])
+        'body': to_json({
+            'order': response['Item']
         })
     }
 
-# list all orders with optional filtering
+# list orders a page at a time with optional status filtering
 def list_orders(event):
     query_params = event.get('queryStringParameters') or {}
     
-    # scan table (for production, consider pagination)
-    response = table.scan()
-    items = response.get('Items', [])
+    # validate page size
+    try:
+        limit = int(query_params.get('limit', DEFAULT_PAGE_SIZE))
+    except ValueError:
+        limit = 0
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        return {
+            'statusCode': 400,
+            'body': to_json({'error': f'limit must be between 1 and {MAX_PAGE_SIZE}'})
+        }
+    
+    page_kwargs = {'Limit': limit}
     
-    # filter by status if provided
+    # resume from the previous page if a token was passed
+    next_token = query_params.get('next_token')
+    if next_token:
+        try:
+            page_kwargs['ExclusiveStartKey'] = decode_page_token(next_token)
+        except ValueError:
+            return {
+                'statusCode': 400,
+                'body': to_json({'error': 'invalid next_token'})
+            }
+    
+    # filter by status if provided, using the status index
     status_filter = query_params.get('status')
-    if status_filter:
-        items = [item for item in items if item.get('status') == status_filter.upper()]
+    try:
+        if status_filter:
+            response = table.query(
+                IndexName=STATUS_INDEX,
+                KeyConditionExpression=Key('status').eq(status_filter.upper()),
+                **page_kwargs
+            )
+        else:
+            response = table.scan(**page_kwargs)
+    except ClientError as e:
+        # a token from another listing or a tampered one is a bad start key
+        if not next_token or e.response['Error']['Code'] != 'ValidationException':
+            raise
+        return {
+            'statusCode': 400,
+            'body': to_json({'error': 'invalid next_token'})
+        }
+    
+    items = response.get('Items', [])
+    result = {
+        'count': len(items),
+        'orders': items
+    }
+    if 'LastEvaluatedKey' in response:
+        result['next_token'] = encode_page_token(response['LastEvaluatedKey'])
+    
+    body = orjson.dumps(result, default=decimal_default)
+    
+    # compress large pages, returned base64 encoded as api gateway requires
+    if len(body) > GZIP_MIN_BYTES and accepts_gzip(event):
+        return {
+            'statusCode': 200,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Content-Encoding': 'gzip',
+                'Vary': 'Accept-Encoding'
+            },
+            'isBase64Encoded': True,
+            'body': base64.b64encode(gzip.compress(body, compresslevel=1)).decode()
+        }
     
     return {
         'statusCode': 200,
         'headers': {'Content-Type': 'application/json'},
-        'body': json.dumps({
-            'count': len(items),
-            'orders': decimal_to_number(items)
-        })
+        'body': body.decode()
     }
 
+# check whether the client sent accept-encoding: gzip
+def accepts_gzip(event):
+    headers = event.get('headers') or {}
+    for name, value in headers.items():
+        if name.lower() == 'accept-encoding' and 'gzip' in (value or '').lower():
+            return True
+    return False
+
+# encode a dynamodb LastEvaluatedKey as an opaque url-safe token
+def encode_page_token(last_key):
+    return base64.urlsafe_b64encode(orjson.dumps(last_key)).decode()
+
+# decode a token from encode_page_token, raising ValueError if malformed
+def decode_page_token(token):
+    last_key = orjson.loads(base64.urlsafe_b64decode(token))
+    if not isinstance(last_key, dict):
+        raise ValueError('page token must decode to an object')
+    # every key attribute of the table and StatusIndex is a string
+    if not all(isinstance(v, str) for v in last_key.values()):
+        raise ValueError('page token values must be strings')
+    return last_key
+
 # update order status
 def update_order(event, order_id):
-    body = json.loads(event['body'])
+    body = parse_body(event)
     
     # validate status field
     if 'status' not in body:
         return {
             'statusCode': 400,
-            'body': json.dumps({'error': 'status field is required'})
+            'body': to_json({'error': 'status field is required'})
         }
     
-    allowed_statuses = ['PENDING', 'PROCESSING', 'COMPLETED', 'CANCELLED', 'EXPIRED']
-    if body['status'].upper() not in allowed_statuses:
+    if body['status'].upper() not in ALLOWED_STATUSES:
         return {
             'statusCode': 400,
-            'body': json.dumps({
-                'error': f'status must be one of: {", ".join(allowed_statuses)}'
-            })
+            'body': to_json({'error': ALLOWED_STATUSES_ERROR})
         }
     
-    # check if order exists
-    existing = table.get_item(Key={'order_id': order_id})
-    if 'Item' not in existing:
+    # update the order, failing the write if it doesn't exist
+    try:
+        response = item_table.update_item(
+            Key={'order_id': order_id},
+            UpdateExpression='SET #status = :status',
+            ConditionExpression='attribute_exists(order_id)',
+            ExpressionAttributeNames={'#status': 'status'},
+            ExpressionAttributeValues={':status': body['status'].upper()},
+            ReturnValues='ALL_NEW'
+        )
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
         return {
             'statusCode': 404,
-            'body': json.dumps({'error': 'order not found'})
+            'body': to_json({'error': 'order not found'})
         }
     
-    # update the order
-    response = table.update_item(
-        Key={'order_id': order_id},
-        UpdateExpression='SET #status = :status',
-        ExpressionAttributeNames={'#status': 'status'},
-        ExpressionAttributeValues={':status': body['status'].upper()},
-        ReturnValues='ALL_NEW'
-    )
-    
     return {
         'statusCode': 200,
         'headers': {'Content-Type': 'application/json'},
-        'body': json.dumps({
+        'body': to_json({
             'message': 'order updated successfully',
-            'order': decimal_to_number(response['Attributes'])
+            'order': response['Attributes']
         })
     }
 
 # delete order
 def delete_order(order_id):
-    # check if order exists
-    existing = table.get_item(Key={'order_id': order_id})
-    if 'Item' not in existing:
+    # delete the order, failing the write if it doesn't exist
+    try:
+        item_table.delete_item(
+            Key={'order_id': order_id},
+            ConditionExpression='attribute_exists(order_id)'
+        )
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
         return {
             'statusCode': 404,
-            'body': json.dumps({'error': 'order not found'})
+            'body': to_json({'error': 'order not found'})
         }
     
-    table.delete_item(Key={'order_id': order_id})
-    
     return {
         'statusCode': 200,
         'headers': {'Content-Type': 'application/json'},
-        'body': json.dumps({
+        'body': to_json({
             'message': 'order deleted successfully',
             'order_id': order_id
         })
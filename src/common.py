@@ -0,0 +1,31 @@
+import orjson
+from botocore.config import Config
+from decimal import Decimal
+
+# shared client config, built once per container
+config = Config(
+    max_pool_connections=64,
+    connect_timeout=1.0,
+    read_timeout=3.0,
+    retries={'mode': 'adaptive', 'max_attempts': 5},
+    tcp_keepalive=True
+)
+
+STATUS_INDEX = 'StatusIndex'
+
+# range of integers orjson can serialize
+JSON_INT_MIN = -2 ** 63
+JSON_INT_MAX = 2 ** 64 - 1
+
+# orjson hook that serializes dynamodb decimals as int/float;
+# whole numbers outside orjson's integer range fall back to float
+def decimal_default(obj):
+    if isinstance(obj, Decimal):
+        if obj % 1 == 0 and JSON_INT_MIN <= obj <= JSON_INT_MAX:
+            return int(obj)
+        return float(obj)
+    raise TypeError
+
+# serialize a response body to a json string (api gateway expects str)
+def to_json(obj):
+    return orjson.dumps(obj, default=decimal_default).decode()
@@ -1,23 +1,45 @@
-import json
+import random
+import time
 import boto3
+from boto3.dynamodb.conditions import Key
+from boto3.dynamodb.types import TypeSerializer
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from decimal import Decimal
+from common import STATUS_INDEX, config, to_json
 
-dynamodb = boto3.resource('dynamodb')
+dynamodb = boto3.resource('dynamodb', config=config)
 table = dynamodb.Table('Orders')
 
+# batch writes run on worker threads, and only clients are thread-safe,
+# so they use the low-level client with items marshaled up front
+client = dynamodb.meta.client
+serializer = TypeSerializer()
+
 EXPIRY_HOURS = 60
 
-# helper function to convert decimal to int/float for json serialization
-def decimal_to_number(obj):
-    if isinstance(obj, list):
-        return [decimal_to_number(i) for i in obj]
-    elif isinstance(obj, dict):
-        return {k: decimal_to_number(v) for k, v in obj.items()}
-    elif isinstance(obj, Decimal):
-        return int(obj) if obj % 1 == 0 else float(obj)
-    else:
-        return obj
+# batch_write_item accepts at most 25 put/delete requests per call
+BATCH_WRITE_SIZE = 25
+MAX_BATCH_RETRIES = 5
+
+# number of batches kept in flight at once
+WRITE_WORKERS = 8
+
+# write a batch of requests, re-submitting unprocessed items with backoff
+def write_batch(requests):
+    request_items = {table.name: requests}
+    
+    for attempt in range(MAX_BATCH_RETRIES + 1):
+        response = client.batch_write_item(RequestItems=request_items)
+        request_items = response.get('UnprocessedItems') or {}
+        
+        if not request_items:
+            return
+        
+        if attempt < MAX_BATCH_RETRIES:
+            time.sleep(2 ** attempt * 0.05 + random.random() * 0.05)
+    
+    unprocessed = sum(len(r) for r in request_items.values())
+    raise RuntimeError(f'{unprocessed} items still unprocessed after {MAX_BATCH_RETRIES} retries')
 
 def lambda_handler(event, context):
     """
@@ -28,71 +50,82 @@ def lambda_handler(event, context):
         expired_count = 0
         expired_orders = []
         
+        # one timestamp for the whole sweep, used for the cutoff and expired_at
+        now = datetime.utcnow()
+        now_iso = now.isoformat() + 'Z'
+        
         # calculate the cutoff time
-        cutoff_time = datetime.utcnow() - timedelta(hours=EXPIRY_HOURS)
+        cutoff_time = now - timedelta(hours=EXPIRY_HOURS)
         cutoff_timestamp = cutoff_time.isoformat() + 'Z'
         
         print(f"checking for pending orders older than {cutoff_timestamp}")
         
-        # scan for pending orders
-        response = table.scan(
-            FilterExpression='#status = :pending',
-            ExpressionAttributeNames={'#status': 'status'},
-            ExpressionAttributeValues={':pending': 'PENDING'}
-        )
+        # query the status index for pending orders created before the cutoff.
+        # no ProjectionExpression: expired orders are re-put whole through
+        # batch_write_item, so a projected item would drop its other attributes
+        query_kwargs = {
+            'IndexName': STATUS_INDEX,
+            'KeyConditionExpression': Key('status').eq('PENDING') & Key('created_at').lt(cutoff_timestamp)
+        }
+        pending_orders = []
+        
+        while True:
+            response = table.query(**query_kwargs)
+            pending_orders.extend(response.get('Items', []))
+            
+            if 'LastEvaluatedKey' not in response:
+                break
+            query_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
         
-        pending_orders = response.get('Items', [])
         print(f"found {len(pending_orders)} pending orders")
         
+        requests = []
+        
+        # orders without created_at (legacy orders) are not in the index
         for order in pending_orders:
             order_id = order['order_id']
-            created_at = order.get('created_at', '')
+            created_at = order['created_at']
+            
+            # queue the expired order, re-putting the full item
+            expired_item = {**order, 'status': 'EXPIRED', 'expired_at': now_iso}
+            requests.append({
+                'PutRequest': {
+                    'Item': {k: serializer.serialize(v) for k, v in expired_item.items()}
+                }
+            })
             
-            # skip orders without timestamp (legacy orders)
-            if not created_at:
-                print(f"skipping order {order_id} - no created_at timestamp")
-                continue
+            expired_count += 1
+            expired_orders.append({
+                'order_id': order_id,
+                'item': order.get('item'),
+                'created_at': created_at
+            })
             
-            # check if order is older than threshold
-            if created_at < cutoff_timestamp:
-                # expire the order
-                table.update_item(
-                    Key={'order_id': order_id},
-                    UpdateExpression='SET #status = :expired, expired_at = :expired_at',
-                    ExpressionAttributeNames={'#status': 'status'},
-                    ExpressionAttributeValues={
-                        ':expired': 'EXPIRED',
-                        ':expired_at': datetime.utcnow().isoformat() + 'Z'
-                    }
-                )
-                
-                expired_count += 1
-                expired_orders.append({
-                    'order_id': order_id,
-                    'item': order.get('item'),
-                    'created_at': created_at
-                })
-                
-                print(f"expired order {order_id} (created: {created_at})")
+            print(f"expired order {order_id} (created: {created_at})")
+        
+        # write the expired orders in 25-item batches, several at a time
+        batches = [requests[i:i + BATCH_WRITE_SIZE] for i in range(0, len(requests), BATCH_WRITE_SIZE)]
+        with ThreadPoolExecutor(max_workers=WRITE_WORKERS) as executor:
+            list(executor.map(write_batch, batches))
         
         result = {
             'message': 'order expiry check completed',
-            'checked_at': datetime.utcnow().isoformat() + 'Z',
+            'checked_at': now_iso,
             'total_pending_checked': len(pending_orders),
             'orders_expired': expired_count,
             'expired_order_ids': [o['order_id'] for o in expired_orders]
         }
         
-        print(json.dumps(result))
+        print(to_json(result))
         
         return {
             'statusCode': 200,
-            'body': json.dumps(result)
+            'body': to_json(result)
         }
         
     except Exception as e:
         print(f"error during order expiry check: {str(e)}")
         return {
             'statusCode': 500,
-            'body': json.dumps({'error': str(e)})
+            'body': to_json({'error': str(e)})
         }